@@ -5,10 +5,125 @@ Générateur de G-code à partir de fonctions mathématiques
 Usage: python3 gcode_generator.py
 """
 
+import ast
 import math
 import sys
 
-def generate_gcode_from_function(func_str, x_start, x_end, num_points, feedrate, output_file):
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # numba absent : évaluation NumPy vectorisée seule
+    numba = None
+
+# Gabarits de lignes G-code des boucles de génération (méthodes liées,
+# appelées par map() sur les tableaux de points)
+_G1_FMT = "G1 X{:.3f}".format
+_XYF_FMT = "F{}\nG1 X{:.2f} Y{:.2f}".format
+
+_HALF_PI = math.pi / 2.0
+
+# Fonctions disponibles dans les expressions utilisateur
+# Variables disponibles: x, sin, cos, tan, exp, log, sqrt, abs, etc.
+_MATH_FUNCS = {
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "asin": math.asin,
+    "acos": math.acos,
+    "atan": math.atan,
+    "sinh": math.sinh,
+    "cosh": math.cosh,
+    "tanh": math.tanh,
+    "exp": math.exp,
+    "log": math.log,
+    "log10": math.log10,
+    "sqrt": math.sqrt,
+    "abs": abs,
+    "pi": math.pi,
+    "e": math.e,
+}
+
+# Mêmes noms, version ufunc NumPy (évaluation sur un tableau x entier)
+_NUMPY_FUNCS = {
+    "sin": np.sin,
+    "cos": np.cos,
+    "tan": np.tan,
+    "asin": np.arcsin,
+    "acos": np.arccos,
+    "atan": np.arctan,
+    "sinh": np.sinh,
+    "cosh": np.cosh,
+    "tanh": np.tanh,
+    "exp": np.exp,
+    "log": np.log,
+    "log10": np.log10,
+    "sqrt": np.sqrt,
+    "abs": np.abs,
+    "pi": np.pi,
+    "e": np.e,
+}
+
+# Seuls nœuds acceptés dans l'expression : arithmétique, comparaisons,
+# expression conditionnelle, appels directs aux fonctions ci-dessus.
+# Attribute/Subscript/Lambda... sont refusés : pas d'accès à
+# ().__class__.__mro__ & co, donc pas besoin de vider __builtins__.
+_ALLOWED_CALLS = frozenset(name for name, v in _MATH_FUNCS.items() if callable(v))
+_ALLOWED_NAMES = frozenset(_MATH_FUNCS) | {"x"}
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare,
+    ast.IfExp, ast.Call, ast.Name, ast.Load, ast.Constant,
+    # Opérateurs arithmétiques seulement : ni @ ni opérateurs bit à bit (~ compris)
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub, ast.Not, ast.And, ast.Or,
+    # Comparaisons numériques seulement : ni in / not in ni is / is not
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+)
+
+
+def _parse_expression(func_str):
+    """
+    Valide l'expression utilisateur par parcours de l'AST
+    
+    Retourne l'arbre validé : compilé une fois pour l'évaluation NumPy comme
+    pour l'évaluation point par point, et seule source du code JIT.
+    Lève SyntaxError ou ValueError.
+    """
+    tree = ast.parse(func_str, mode="eval")
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"construction non autorisée: {type(node).__name__}")
+        if isinstance(node, ast.Name) and node.id not in _ALLOWED_NAMES:
+            raise ValueError(f"nom inconnu: {node.id}")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in _ALLOWED_CALLS:
+                raise ValueError("appel de fonction non autorisé")
+            if node.keywords:
+                raise ValueError("arguments nommés non autorisés")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(f"constante non numérique: {node.value!r}")
+    return tree
+
+
+def _jit_function(tree):
+    """
+    Compile l'expression en ufunc native parallèle via numba
+    
+    tree est l'arbre validé par _parse_expression : le source de _f en est
+    régénéré (commentaires et texte brut de l'utilisateur exclus).
+    Retourne None si numba ne sait pas la typer, l'appelant
+    repasse alors par NumPy.
+    """
+    ns = {**_MATH_FUNCS, "__builtins__": {}}
+    try:
+        exec(f"def _f(x):\n    return ({ast.unparse(tree.body)})\n", ns)
+        return numba.vectorize(["f8(f8)"], target="parallel")(ns["_f"])
+    except Exception:
+        return None
+
+
+def generate_gcode_from_function(func_str, x_start, x_end, num_points, feedrate, output_file,
+                                 use_numba=False):
     """
     Génère un fichier G-code à partir d'une fonction mathématique
     
@@ -19,6 +134,9 @@ def generate_gcode_from_function(func_str, x_start, x_end, num_points, feedrate,
         num_points: Nombre de points à calculer
         feedrate: Vitesse en mm/min (ex: 3000)
         output_file: Nom du fichier de sortie
+        use_numba: Évaluer via numba plutôt que NumPy (option --numba). Désactivé
+            par défaut : compilation JIT comprise, NumPy reste plus rapide
+            (mesuré de 10k à 1M points)
     """
     
     # En-tête du fichier G-code
@@ -38,64 +156,90 @@ def generate_gcode_from_function(func_str, x_start, x_end, num_points, feedrate,
     gcode.append(f"F{feedrate}")
     gcode.append("")
     
-    # Calcul des points
-    x_step = (x_end - x_start) / (num_points - 1)
+    # Calcul des points : l'expression est évaluée une seule fois sur tout
+    # le tableau x (ufuncs NumPy) au lieu d'un eval() par point
+    xs = np.linspace(x_start, x_end, num_points)
     
     print(f"\nGénération de {num_points} points...")
     print(f"Fonction: y = {func_str}")
     print(f"Range X: {x_start} à {x_end}")
     print(f"Feedrate: F{feedrate} ({feedrate/60:.1f} mm/s)\n")
     
-    for i in range(num_points):
-        x = x_start + i * x_step
-        
-        # Évaluation de la fonction
-        # Variables disponibles: x, sin, cos, tan, exp, log, sqrt, abs, etc.
-        try:
-            y = eval(func_str, {
-                "x": x,
-                "sin": math.sin,
-                "cos": math.cos,
-                "tan": math.tan,
-                "asin": math.asin,
-                "acos": math.acos,
-                "atan": math.atan,
-                "sinh": math.sinh,
-                "cosh": math.cosh,
-                "tanh": math.tanh,
-                "exp": math.exp,
-                "log": math.log,
-                "log10": math.log10,
-                "sqrt": math.sqrt,
-                "abs": abs,
-                "pi": math.pi,
-                "e": math.e,
-                "__builtins__": {}  # Sécurité
-            })
-            
-            gcode.append(f"G1 X{x:.3f}")
-            
-            if i % 10 == 0:  # Afficher progression
-                print(f"Point {i+1}/{num_points}: X={x:.3f}")
-                
-        except Exception as e:
-            print(f"ERREUR au point {i}: x={x}, erreur={e}")
-            sys.exit(1)
+    try:
+        tree = _parse_expression(func_str)
+    except (SyntaxError, ValueError) as e:
+        print(f"ERREUR fonction invalide: {func_str}, erreur={e}")
+        sys.exit(1)
+    code = compile(tree, "<gcode-func>", "eval")
+    
+    y = None
+    if use_numba and numba is not None:
+        f_jit = _jit_function(tree)
+        if f_jit is not None:
+            try:
+                with np.errstate(all="ignore"):
+                    y = f_jit(xs)
+            except Exception:  # ex: ZeroDivisionError levée par le code natif
+                y = None
+    
+    try:
+        if y is None:
+            with np.errstate(all="ignore"):
+                y = eval(code, {**_NUMPY_FUNCS, "x": xs})
+            if np.ndim(y) == 0:  # Fonction constante
+                y = np.full(num_points, y, dtype=np.float64)
+    except Exception:
+        # Expression non vectorisable (ex: "x if x > 0 else 0") : point par point
+        ns = dict(_MATH_FUNCS)
+        y = np.empty(num_points)
+        for i, x in enumerate(xs.tolist()):
+            ns["x"] = x
+            try:
+                y[i] = eval(code, ns)
+            except Exception as e:
+                print(f"ERREUR au point {i}: x={x}, erreur={e}")
+                sys.exit(1)
+    
+    # NumPy renvoie nan/inf là où math lève une erreur (log(-1), 1/0...)
+    bad = np.flatnonzero(~np.isfinite(y))
+    if bad.size:
+        i = int(bad[0])
+        print(f"ERREUR au point {i}: x={xs[i]}, erreur=valeur hors domaine ({y[i]})")
+        sys.exit(1)
+    
+    body = list(map(_G1_FMT, xs.tolist()))
     
     # Fin du programme
-    gcode.append("")
-    gcode.append("G4 P1.0")
-    gcode.append("(Retour origine)")
-    gcode.append("G0 X0")
-    gcode.append("M2")
-    gcode.append("%")
+    footer = ["", "G4 P1.0", "(Retour origine)", "G0 X0", "M2", "%"]
     
-    # Écriture du fichier
+    # Écriture du fichier : en-tête, points et fin écrits à la suite
     with open(output_file, 'w') as f:
-        f.write('\n'.join(gcode))
+        f.write('\n'.join(gcode) + '\n')
+        f.write('\n'.join(body) + '\n')
+        f.write('\n'.join(footer))
     
     print(f"\n✓ Fichier généré: {output_file}")
-    print(f"✓ {len(gcode)} lignes de G-code")
+    print(f"✓ {len(gcode) + len(body) + len(footer)} lignes de G-code")
+
+
+def profile_speed_vec(progress, top_speed_mmmin, ramp_fraction=0.2):
+    """
+    Calcule la vitesse (mm/min) pour un tableau d'avancements (0-1)
+    
+    Rampe sinusoïdale sur ramp_fraction de la course au départ et à
+    l'arrivée, palier à top_speed_mmmin entre les deux.
+    """
+    progress = np.clip(progress, 0.0, 1.0)
+    inv_ramp = 1.0 / ramp_fraction
+    frac = np.where(progress <= ramp_fraction,
+                    np.sin(_HALF_PI * (progress * inv_ramp)),
+                    np.where(progress >= (1.0 - ramp_fraction),
+                             np.sin(_HALF_PI * ((1.0 - progress) * inv_ramp)),
+                             1.0))
+    
+    # Éviter une vitesse nulle dans le G-code
+    min_speed = max(top_speed_mmmin * 0.05, 60.0)
+    return np.maximum(top_speed_mmmin * frac, min_speed)
 
 
 def generate_progressive_sine_test(output_file="/home/cnc/linuxcnc/nc_files/function-test.ngc"):
@@ -137,82 +281,56 @@ def generate_progressive_sine_test(output_file="/home/cnc/linuxcnc/nc_files/func
     x_step = (x_end - x_start) / num_segments
     y_step = (y_end - y_start) / num_segments
     ramp_fraction = 0.2  # 1/5 de la distance pour l'accélération/décélération
-
-    def profile_speed(progress: float, top_speed_mmmin: float) -> float:
-        """Calcule la vitesse (mm/min) en fonction de l'avancement (0-1)."""
-        progress = max(0.0, min(1.0, progress))
-
-        if progress <= ramp_fraction:
-            phase = progress / ramp_fraction
-            frac = math.sin((math.pi / 2) * phase)
-        elif progress >= (1.0 - ramp_fraction):
-            phase = (1.0 - progress) / ramp_fraction
-            frac = math.sin((math.pi / 2) * phase)
-        else:
-            frac = 1.0
-
-        # Éviter une vitesse nulle dans le G-code
-        min_speed = max(top_speed_mmmin * 0.05, 60.0)
-        return max(top_speed_mmmin * frac, min_speed)
     
-    # Boucle sur chaque vitesse de base
-    for test_idx, base_speed in enumerate(base_speeds):
-        gcode.append(f"(Test {test_idx + 1} - Vitesse base: {base_speed} mm/min = {base_speed/60:.1f} mm/s)")
-        gcode.append("")
-        
-        print(f"Génération test {test_idx + 1}/{len(base_speeds)}: vitesse base {base_speed} mm/min ({base_speed/60:.1f} mm/s)")
-        
-        # ALLER avec rampe sinusoïdale puis vitesse constante centrale
-        gcode.append("(Aller - rampe sinus puis vitesse constante)")
-        for i in range(num_segments + 1):
-            x = x_start + i * x_step
-            y = y_start + i * y_step
-
-            progress = i / num_segments
-            current_speed = profile_speed(progress, base_speed)
-            feedrate = int(current_speed)
-
-            if i == 0:
-                gcode.append(f"F{feedrate} G1 X{x:.2f} Y{y:.2f}")
-            else:
-                gcode.append(f"F{feedrate}")
-                gcode.append(f"G1 X{x:.2f} Y{y:.2f}")
-        
-        gcode.append("G4 P0.3")
-        gcode.append("")
-        
-        # RETOUR avec profil identique (rampe sinus puis palier)
-        gcode.append("(Retour - rampe sinus puis vitesse constante)")
-        for i in range(num_segments + 1):
-            x = x_end - i * x_step
-            y = y_end - i * y_step
-
-            progress = i / num_segments
-            current_speed = profile_speed(progress, base_speed)
-            feedrate = int(current_speed)
-
-            if i == 0:
-                gcode.append(f"F{feedrate} G1 X{x:.2f} Y{y:.2f}")
-            else:
-                gcode.append(f"F{feedrate}")
-                gcode.append(f"G1 X{x:.2f} Y{y:.2f}")
-        
-        gcode.append("G4 P0.5")
-        gcode.append("")
+    # Géométrie et avancement identiques pour toutes les vitesses : calculés
+    # une seule fois, le retour parcourt les mêmes points en sens inverse
+    i_arr = np.arange(num_segments + 1)
+    progress = i_arr / num_segments
+    xs_fwd = (x_start + i_arr * x_step).tolist()
+    ys_fwd = (y_start + i_arr * y_step).tolist()
+    xs_bwd = xs_fwd[::-1]
+    ys_bwd = ys_fwd[::-1]
     
-    # Fin du programme
-    gcode.append("(Test termine)")
-    gcode.append("G0 X0 Y0")
-    gcode.append("M2")
-    gcode.append("%")
+    # Écriture du fichier : chaque bloc aller/retour est construit par
+    # compréhension et écrit directement, sans liste globale du programme
+    print(f"Génération de {len(base_speeds)} tests: vitesses base "
+          f"{', '.join(str(v) for v in base_speeds)} mm/min "
+          f"({base_speeds[0]/60:.1f} à {base_speeds[-1]/60:.1f} mm/s)")
     
-    # Écriture du fichier
+    n_lines = len(gcode)
     with open(output_file, 'w') as f:
-        f.write('\n'.join(gcode))
+        f.write('\n'.join(gcode) + '\n')
+        
+        # Boucle sur chaque vitesse de base
+        for test_idx, base_speed in enumerate(base_speeds):
+            feedrates = profile_speed_vec(progress, base_speed, ramp_fraction).astype(np.int32).tolist()
+            
+            # ALLER avec rampe sinusoïdale puis vitesse constante centrale
+            block = [f"(Test {test_idx + 1} - Vitesse base: {base_speed} mm/min = {base_speed/60:.1f} mm/s)", ""]
+            block.append("(Aller - rampe sinus puis vitesse constante)")
+            block.append(f"F{feedrates[0]} G1 X{xs_fwd[0]:.2f} Y{ys_fwd[0]:.2f}")
+            block += map(_XYF_FMT, feedrates[1:], xs_fwd[1:], ys_fwd[1:])
+            block += ["G4 P0.3", ""]
+            
+            # RETOUR avec profil identique (rampe sinus puis palier)
+            block.append("(Retour - rampe sinus puis vitesse constante)")
+            block.append(f"F{feedrates[0]} G1 X{xs_bwd[0]:.2f} Y{ys_bwd[0]:.2f}")
+            block += map(_XYF_FMT, feedrates[1:], xs_bwd[1:], ys_bwd[1:])
+            block += ["G4 P0.5", ""]
+            
+            # Un élément F+G1 par segment : compter les lignes sur le texte final
+            text = '\n'.join(block)
+            f.write(text + '\n')
+            n_lines += text.count('\n') + 1
+        
+        # Fin du programme
+        footer = ["(Test termine)", "G0 X0 Y0", "M2", "%"]
+        f.write('\n'.join(footer))
+        n_lines += len(footer)
     
     print()
     print(f"✓ Fichier généré: {output_file}")
-    print(f"✓ {len(gcode)} lignes de G-code")
+    print(f"✓ {n_lines} lignes de G-code")
     print(f"✓ {len(base_speeds)} tests avec profil de vitesse sinusoidal")
     print(f"✓ Demi-periode par trajet (0→π) - aller ET retour synchronises!")
     print(f"✓ X et Y se déplacent ensemble: 0→200mm")
@@ -577,10 +695,15 @@ def interactive_mode():
 
 
 if __name__ == "__main__":
+    # --numba : évaluation JIT (numba requis), opt-in
+    use_numba = "--numba" in sys.argv
+    if use_numba:
+        sys.argv.remove("--numba")
+    
     if len(sys.argv) > 1:
         # Mode ligne de commande
         if len(sys.argv) < 6:
-            print("Usage: python3 gcode_generator.py 'function' x_start x_end num_points feedrate_mm_min [output_file]")
+            print("Usage: python3 gcode_generator.py [--numba] 'function' x_start x_end num_points feedrate_mm_min [output_file]")
             print("Exemple: python3 gcode_generator.py '50*sin(x)' 0 100 200 3000 test.ngc")
             sys.exit(1)
         
@@ -591,7 +714,8 @@ if __name__ == "__main__":
         feedrate = int(sys.argv[5])
         output = sys.argv[6] if len(sys.argv) > 6 else "/home/cnc/linuxcnc/nc_files/function-test.ngc"
         
-        generate_gcode_from_function(func, x_start, x_end, num_points, feedrate, output)
+        generate_gcode_from_function(func, x_start, x_end, num_points, feedrate, output,
+                                     use_numba=use_numba)
     else:
         # Mode interactif
         interactive_mode()
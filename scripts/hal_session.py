@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Persistent halcmd session for the tuning scripts
+One long-lived `halcmd -kf` reads commands from stdin, instead of forking
+a new halcmd (and attaching to HAL) for every single pin read
+"""
+
+import os
+import re
+import select
+import shutil
+import subprocess
+import time
+
+# After each command, a getp of this (nonexistent) pin: halcmd answers with
+# one error line naming it, which marks where that command's output ends
+SYNC_PIN = 'hal-session-sync-'
+SYNC_RE = re.compile(rb'hal-session-sync-(\d+)')
+
+
+class HalCmd:
+    def __init__(self, timeout=1.0):
+        self.timeout = timeout
+
+        # halcmd uses stdio: without line buffering its replies stay in the
+        # pipe buffer and every read would time out
+        stdbuf = shutil.which('stdbuf')
+        if stdbuf is None:
+            raise RuntimeError("stdbuf (coreutils) not found: cannot line-buffer halcmd")
+
+        # stderr merged into stdout: a failed command still answers with its
+        # error line, right before its sync marker
+        self.proc = subprocess.Popen([stdbuf, '-oL', 'halcmd', '-kf'], stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0)
+        self.fd = self.proc.stdout.fileno()
+        self.buf = b''
+        self.seq = 0
+
+    def _fill(self, timeout):
+        """Append whatever halcmd wrote within timeout, False if nothing came"""
+        if not select.select([self.fd], [], [], max(timeout, 0))[0]:
+            return False
+        data = os.read(self.fd, 4096)
+        if not data:
+            raise OSError("halcmd exited")
+        self.buf += data
+        return True
+
+    def _request(self, cmds):
+        """Send cmds in one write, return each one's output lines
+
+        An entry is None if its marker did not come back within the timeout.
+        Output that arrives later (from a timed-out request) carries an older
+        marker number and is discarded, so it is never read as a new reply.
+        """
+        first = self.seq
+        self.seq += len(cmds)
+        self.proc.stdin.write(''.join(f'{cmd}\ngetp {SYNC_PIN}{first + i}\n'
+                                      for i, cmd in enumerate(cmds)).encode())
+
+        replies = [None] * len(cmds)
+        lines = []
+        deadline = time.monotonic() + self.timeout
+        while replies[-1] is None:
+            while b'\n' not in self.buf:
+                if not self._fill(deadline - time.monotonic()):
+                    return replies
+            line, self.buf = self.buf.split(b'\n', 1)
+            mark = SYNC_RE.search(line)
+            if mark is None:
+                lines.append(line)
+                continue
+            n = int(mark.group(1)) - first
+            if n >= 0:
+                replies[n] = lines
+            lines = []
+        return replies
+
+    @staticmethod
+    def _value(lines, default):
+        """A getp reply is exactly one numeric line, anything else is default"""
+        if lines is None or len(lines) != 1:
+            return default
+        try:
+            return float(lines[0])
+        except ValueError:
+            return default
+
+    def run(self, cmd):
+        """Execute a halcmd command and return its output"""
+        try:
+            lines = self._request([cmd])[0]
+        except OSError:
+            return ""
+        return b'\n'.join(lines or []).decode(errors='replace').strip()
+
+    def getp(self, pin, default=0.0):
+        """Get HAL pin/param value (default if missing or timed out)"""
+        return self.getp_many([pin], default)[0]
+
+    def getp_many(self, pins, default=0.0):
+        """Get several HAL pin/param values in one round-trip"""
+        try:
+            replies = self._request([f'getp {pin}' for pin in pins])
+        except OSError:
+            return [default] * len(pins)
+        return [self._value(lines, default) for lines in replies]
+
+    def setp(self, pin, value):
+        """Set HAL pin/param value"""
+        # Waits for the marker: an error line can't spill into the next reply
+        try:
+            self._request([f'setp {pin} {value}'])
+        except OSError:
+            pass
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
@@ -6,11 +6,27 @@ Uses Nelder-Mead or Differential Evolution algorithms
 
 import hal
 import linuxcnc
+import math
 import time
+import functools
+import subprocess
+import shutil
+import select
+import os
+import re
 import numpy as np
-from scipy.optimize import minimize, differential_evolution
 import sys
 
+# Pins recorded in the servo thread by sampler.0 (cfg=ffff):
+# (PID pin, existing HAL signal or the one to create)
+SAMPLER_PINS = (
+    ('pid.x.error', 'pidopt-x-error'),
+    ('pid.y.error', 'pidopt-y-error'),
+    ('pid.x.output', 'x-vel-cmd'),
+    ('pid.y.output', 'y-vel-cmd'),
+)
+POLL_PINS = tuple(pin for pin, _ in SAMPLER_PINS)
+
 class PIDOptimizer:
     def __init__(self):
         self.h = hal.component("pid_optimizer")
@@ -34,6 +50,75 @@ class PIDOptimizer:
         self.eval_count = 0
         self.best_rms = 999
         self.best_params = {}
+        # Cumulative squared error of the best trial's outbound leg, the
+        # early-abort reference (None until a trial has completed)
+        self.best_profile = None
+        
+        # Results of already-measured parameter sets: DE and Nelder-Mead
+        # revisit nearby points, and each machine move costs ~1-2 s
+        self._cache = {}
+        self.cache_hits = 0
+        
+        self.use_sampler = self.setup_sampler()
+    
+    def setup_sampler(self):
+        """Load sampler.0 on the servo thread to record PID pins at 1 kHz"""
+        if shutil.which('halsampler') is None:
+            print("⚠ halsampler not found, falling back to polling")
+            return False
+        if shutil.which('stdbuf') is None:
+            # halsampler's stdio output would sit in the pipe buffer for the
+            # whole move, so the early abort could never fire
+            print("⚠ stdbuf not found, falling back to polling")
+            return False
+        if hal.component_exists('sampler'):
+            if self.sampler_wired():
+                return True
+            # Not ours, or wired differently: leave it alone
+            print("⚠ sampler.0 already loaded but not wired to the PID pins, falling back to polling")
+            return False
+        
+        cmds = [
+            ['halcmd', 'loadrt', 'sampler', 'depth=4096', 'cfg=ffff'],
+            ['halcmd', 'addf', 'sampler.0', 'servo-thread'],
+            ['halcmd', 'setp', 'sampler.0.enable', '0'],
+        ]
+        cmds += [['halcmd', 'net', sig, pin, f'sampler.0.pin.{i}']
+                 for i, (pin, sig) in enumerate(SAMPLER_PINS)]
+        for i, cmd in enumerate(cmds):
+            try:
+                result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
+                failed = result.returncode != 0
+            except (OSError, subprocess.TimeoutExpired) as e:
+                print(f"⚠ sampler unavailable ({e}), falling back to polling")
+                failed = True
+            else:
+                if failed:
+                    print(f"⚠ '{' '.join(cmd)}' failed, falling back to polling")
+            if failed:
+                # Don't leave a half-wired sampler.0 behind for the next run
+                if i > 0:
+                    self.halcmd('unloadrt', 'sampler')
+                return False
+        return True
+    
+    def halcmd(self, *args):
+        """Run one halcmd command, return its stdout ('' on failure)"""
+        try:
+            result = subprocess.run(['halcmd', *args], capture_output=True, text=True, timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            return ''
+        return result.stdout if result.returncode == 0 else ''
+    
+    def sampler_wired(self):
+        """True if every SAMPLER_PINS pair is linked to sampler.0.pin.N"""
+        pins = self.halcmd('show', 'pin')
+        for i, (pin, sig) in enumerate(SAMPLER_PINS):
+            sig = re.escape(sig)
+            if not (re.search(rf'{re.escape(pin)}\s+==>\s+{sig}(?!\S)', pins) and
+                    re.search(rf'sampler\.0\.pin\.{i}\s+<==\s+{sig}(?!\S)', pins)):
+                return False
+        return True
     
     def getp(self, name):
         try:
@@ -41,6 +126,14 @@ class PIDOptimizer:
         except:
             return 0
     
+    def read_pid_pins(self):
+        """Read pid.{x,y}.error and pid.{x,y}.output in a single call"""
+        get = hal.get_value
+        try:
+            return tuple(get(pin) for pin in POLL_PINS)
+        except Exception:
+            return (0, 0, 0, 0)
+    
     def setp(self, name, value):
         try:
             hal.set_p(name, str(value))
@@ -90,85 +183,211 @@ class PIDOptimizer:
         self.cmd.mdi(gcode)
         return True
     
-    def collect_during_move(self, target_x, target_y):
-        """Collect error samples during a move"""
-        errors = []
+    def collect_during_move(self, target_x, target_y, early_abort=False):
+        """Collect error samples during a move, returns (errors, aborted)
+        
+        With early_abort, the move is aborted as soon as its running RMS
+        exceeds twice the best trial's RMS over the same number of samples.
+        The errors are then only the samples recorded before the abort.
+        """
+        profile = self.best_profile if early_abort else None
+        if self.use_sampler:
+            return self.collect_sampled(target_x, target_y, profile)
+        return self.collect_polled(target_x, target_y, profile)
+    
+    @staticmethod
+    def diverging(profile, s2, n):
+        """RMS of the first n samples above twice the best trial's over its first n"""
+        # Same window on both sides: the first samples are the acceleration
+        # phase, they can't be held against the best trial's whole-move RMS
+        k = min(n, profile.size)
+        return n > 20 and s2 / n > 4 * profile[k - 1] / k
+    
+    def errors_from_samples(self, text):
+        """Max |X|,|Y| error (µm) of the halsampler lines where axes move"""
+        data = np.array(text.split(), dtype=np.float64)
+        data = data[:data.size - data.size % len(SAMPLER_PINS)].reshape(-1, len(SAMPLER_PINS))
+        err = np.maximum(np.abs(data[:, 0]), np.abs(data[:, 1])) * 1000  # µm
+        vel = np.abs(data[:, 2]) + np.abs(data[:, 3])
+        return err[vel > 5]
+    
+    def collect_sampled(self, target_x, target_y, profile=None):
+        """Collect error samples recorded by sampler.0 in the servo thread"""
+        timeout = (self.test_distance * 1.5 / (self.test_feed / 60)) + 0.5
+        
+        # Line-buffered so samples reach the pipe during the move (early abort)
+        reader = subprocess.Popen(['stdbuf', '-oL', 'halsampler', '-c', '0'],
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        fd = reader.stdout.fileno()
+        raw = bytearray()
+        scored = 0  # end of the last complete line included in s2/n
+        s2, n = 0.0, 0
+        aborted = False
         
+        self.setp('sampler.0.enable', 1)
+        try:
+            self.run_move(target_x, target_y)
+            time.sleep(0.01)
+            
+            # Only stat is polled here, HAL pins are read by the RT thread
+            start = time.time()
+            while time.time() - start < timeout:
+                self.stat.poll()
+                
+                # Score complete lines as they arrive to abort a diverging trial
+                if profile is not None and select.select([fd], [], [], 0)[0]:
+                    raw += os.read(fd, 65536)
+                    end = raw.rfind(b'\n') + 1
+                    if end > scored:
+                        err = self.errors_from_samples(bytes(raw[scored:end]))
+                        scored = end
+                        s2 += float(np.dot(err, err))
+                        n += err.size
+                        if self.diverging(profile, s2, n):
+                            self.cmd.abort()
+                            aborted = True
+                            break
+                
+                if self.stat.interp_state == linuxcnc.INTERP_IDLE:
+                    vel = abs(self.getp('pid.x.output')) + abs(self.getp('pid.y.output'))
+                    if vel < 1:
+                        break
+                time.sleep(0.01)
+        finally:
+            self.setp('sampler.0.enable', 0)
+            time.sleep(0.05)  # let halsampler drain the FIFO
+            reader.terminate()
+            try:
+                out, _ = reader.communicate(timeout=2)
+            except subprocess.TimeoutExpired:
+                reader.kill()
+                out, _ = reader.communicate()
+        
+        self.wait_ready()
+        
+        if aborted:
+            return self.errors_from_samples(bytes(raw[:scored])), True
+        return self.errors_from_samples(bytes(raw) + out), False
+    
+    def collect_polled(self, target_x, target_y, profile=None):
+        """Collect error samples by polling HAL pins during a move"""
         self.run_move(target_x, target_y)
         time.sleep(0.01)
         
         start = time.time()
         timeout = (self.test_distance * 1.5 / (self.test_feed / 60)) + 0.5
         
+        # At most one sample per 2 ms poll: preallocate, no per-sample boxing
+        errors = np.empty(int(timeout / 0.002) + 16)
+        n = 0
+        s2 = 0.0
+        
         while time.time() - start < timeout:
-            self.stat.poll()
+            err_x, err_y, out_x, out_y = self.read_pid_pins()
+            vel = abs(out_x) + abs(out_y)
             
-            err_x = self.getp('pid.x.error') * 1000  # µm
-            err_y = self.getp('pid.y.error') * 1000
-            vel = abs(self.getp('pid.x.output')) + abs(self.getp('pid.y.output'))
+            if vel > 5 and n < errors.size:
+                e = max(abs(err_x), abs(err_y)) * 1000  # µm
+                errors[n] = e
+                n += 1
+                s2 += e * e
+                if profile is not None and self.diverging(profile, s2, n):
+                    self.cmd.abort()
+                    self.wait_ready()
+                    return errors[:n], True
             
-            if vel > 5:
-                errors.append(max(abs(err_x), abs(err_y)))
-            
-            if self.stat.interp_state == linuxcnc.INTERP_IDLE and vel < 1:
-                break
+            # stat only matters for the end condition, which needs vel < 1 too:
+            # no stat.poll() while the axes are moving
+            if vel < 1:
+                self.stat.poll()
+                if self.stat.interp_state == linuxcnc.INTERP_IDLE:
+                    break
                 
             time.sleep(0.002)
         
         self.wait_ready()
-        return errors
+        return errors[:n], False
     
     def evaluate(self, params_dict):
-        """Evaluate a parameter set - returns RMS error"""
+        """Evaluate a parameter set - returns (RMS error, outbound profile)
+        
+        The profile (cumulative squared error of the outbound leg) is None
+        for an aborted trial, which can never become the best one.
+        """
         self.apply_params(params_dict)
         
         x0, y0 = self.get_position()
-        all_errors = []
         
-        # Round-trip move
-        ex = self.collect_during_move(x0 + self.test_distance, y0 + self.test_distance)
-        all_errors.extend(ex)
+        # Round-trip move. Only the outbound leg may be aborted early: the
+        # return leg must always complete to bring the axes back to x0, y0
+        out, aborted = self.collect_during_move(x0 + self.test_distance, y0 + self.test_distance,
+                                                early_abort=True)
+        back, _ = self.collect_during_move(x0, y0)
         
-        ex = self.collect_during_move(x0, y0)
-        all_errors.extend(ex)
+        if aborted:
+            # Penalty from the aborted leg alone, never below the abort
+            # threshold: the return-leg samples would only dilute it
+            partial = float(np.linalg.norm(out)) / math.sqrt(out.size)
+            return max(partial, 2 * self.best_rms), None
         
-        if not all_errors:
-            return 999.0
+        errors = np.concatenate((out, back))
+        if not errors.size:
+            return 999.0, None
         
-        errors = np.array(all_errors)
-        rms = np.sqrt(np.mean(errors**2))
+        # L2 norm as a single dot product, no squared temporary.
+        # Back to a Python float: the rest of the scalar path stays off NumPy
+        rms = float(np.linalg.norm(errors)) / math.sqrt(errors.size)
         
         # Detect oscillation - add penalty
         if len(errors) > 20:
             diff = np.diff(errors)
-            sign_changes = np.sum(np.diff(np.sign(diff)) != 0)
+            # Sign bits as 1-byte lanes, a change is an XOR of neighbours
+            s = np.signbit(diff).view(np.uint8)
+            sign_changes = np.count_nonzero(s[1:] ^ s[:-1])
             if sign_changes > len(diff) * 0.4:
                 rms *= 2
         
-        return rms
+        # No outbound samples, no reference for the abort test
+        return rms, (np.cumsum(out * out) if out.size else None)
     
     def objective(self, x, param_names):
         """Objective function for scipy optimizers"""
         params = self.get_current_params()
         for i, name in enumerate(param_names):
-            params[name] = x[i]
-        
-        rms = self.evaluate(params)
+            params[name] = float(x[i])
+        
+        # 4 significant digits: D and FF2 are ~1e-3, fixed decimals would merge them
+        key = tuple(float(f"{v:.4g}") for v in params.values())
+        if key in self._cache:
+            rms, profile = self._cache[key]
+            self.cache_hits += 1
+            cached = " (cached)"
+        else:
+            rms, profile = self.evaluate(params)
+            self._cache[key] = rms, profile
+            cached = ""
         self.eval_count += 1
         
         if rms < self.best_rms:
             self.best_rms = rms
             self.best_params = params.copy()
+            self.best_profile = profile
         
         # Progress display
         param_str = " ".join([f"{name}={x[i]:.4f}" for i, name in enumerate(param_names)])
-        print(f"  [{self.eval_count:3d}] {param_str} -> RMS={rms:.1f}µm (best={self.best_rms:.1f}µm)")
+        print(f"  [{self.eval_count:3d}] {param_str} -> RMS={rms:.1f}µm (best={self.best_rms:.1f}µm){cached}")
         
         return rms
     
-    def optimize_nelder_mead(self, param_names):
-        """Nelder-Mead simplex optimization"""
-        current = self.get_current_params()
+    def optimize_nelder_mead(self, param_names, start=None):
+        """Nelder-Mead simplex optimization
+        
+        start: parameter dict to warm-start from (e.g. the DE result); the
+        initial simplex is then kept tight (5%) around it.
+        """
+        from scipy.optimize import minimize  # deferred: slow to import on the Pi
+        
+        current = start if start is not None else self.get_current_params()
         x0 = [current[name] for name in param_names]
         bounds_list = [self.bounds[name] for name in param_names]
         
@@ -177,27 +396,40 @@ class PIDOptimizer:
         
         self.eval_count = 0
         self.best_rms = 999
+        self.best_profile = None
+        
+        options = {'maxiter': 30, 'maxfev': 60, 'xatol': 0.1, 'fatol': 1.0}
+        if start is not None:
+            best = np.array(x0, dtype=np.float64)
+            # 5% of the value, or of the bound range for gains at 0 (D, FF2)
+            span = np.array([hi - lo for lo, hi in bounds_list])
+            step = np.where(best != 0, best * 0.05, span * 0.05)
+            options['initial_simplex'] = np.vstack([best, best + np.diag(step)])
+            options['maxiter'] = 20
         
         result = minimize(
-            lambda x: self.objective(x, param_names),
+            functools.partial(self.objective, param_names=tuple(param_names)),
             x0,
             method='Nelder-Mead',
-            options={'maxiter': 30, 'maxfev': 60, 'xatol': 0.1, 'fatol': 1.0}
+            options=options
         )
         
         return self.best_params, self.best_rms
     
     def optimize_de(self, param_names):
         """Differential Evolution optimization"""
+        from scipy.optimize import differential_evolution  # deferred: slow to import on the Pi
+        
         bounds_list = [self.bounds[name] for name in param_names]
         
         print(f"\n🧬 Differential Evolution: {param_names}")
         
         self.eval_count = 0
         self.best_rms = 999
+        self.best_profile = None
         
         result = differential_evolution(
-            lambda x: self.objective(x, param_names),
+            functools.partial(self.objective, param_names=tuple(param_names)),
             bounds_list,
             maxiter=10,
             popsize=5,
@@ -250,7 +482,7 @@ setp pid.y.FF2 {params['FF2']:.6f}
         
         # Get baseline
         print("\n📊 Measuring baseline...")
-        baseline_rms = self.evaluate(current)
+        baseline_rms, _ = self.evaluate(current)
         print(f"   Baseline RMS: {baseline_rms:.1f}µm")
         
         print("\n" + "-" * 40)
@@ -277,7 +509,7 @@ setp pid.y.FF2 {params['FF2']:.6f}
             params, rms = self.optimize_de(['P', 'I', 'FF1'])
             self.apply_params(params)
             print("\n--- Phase 2: Nelder-Mead refinement ---")
-            params, rms = self.optimize_nelder_mead(['P', 'I', 'D', 'FF1', 'FF2'])
+            params, rms = self.optimize_nelder_mead(['P', 'I', 'D', 'FF1', 'FF2'], start=params)
         elif choice == '4':
             params, rms = self.optimize_nelder_mead(['P', 'I'])
         elif choice == '5':
@@ -294,6 +526,7 @@ setp pid.y.FF2 {params['FF2']:.6f}
             print(f"  {k}: {v:.6f}")
         print(f"\nRMS Error: {rms:.1f}µm (was {baseline_rms:.1f}µm)")
         print(f"Improvement: {(baseline_rms - rms):.1f}µm ({100*(baseline_rms-rms)/baseline_rms:.1f}%)")
+        print(f"Cache hits: {self.cache_hits}/{self.cache_hits + len(self._cache)} evaluations skipped")
         
         save = input("\nSave to pid_tuning.hal? [Y/n]: ").strip().lower()
         if save != 'n':
@@ -10,6 +10,7 @@ Controls:
   F/f  - Increase/Decrease FF1 by 0.1
   G/g  - Increase/Decrease FF2 by 0.0001
   X/Y  - Switch axis
+  R    - Re-read gains from HAL now
   Z    - Zero all gains (emergency)
   S    - Save current values
   Q    - Quit
@@ -23,6 +24,27 @@ import select
 import termios
 import tty
 
+from hal_session import HalCmd
+
+# HAL pin names, built once: PINS[axis][param]
+PINS = {axis: {param: f'pid.{axis}.{pin}' for param, pin in
+               (('P', 'Pgain'), ('I', 'Igain'), ('D', 'Dgain'), ('FF1', 'FF1'), ('FF2', 'FF2'))}
+        for axis in ('x', 'y')}
+
+# Gain pins read on every refresh, in (axis, param) order
+PARAM_KEYS = tuple((axis, param) for axis in PINS for param in PINS[axis])
+PARAM_PINS = tuple(PINS[axis][param] for axis, param in PARAM_KEYS)
+
+ERROR_PINS = ('pid.x.error', 'pid.y.error')
+VELOCITY_PINS = ('pid.x.output', 'cia402.0.velocity-fb', 'pid.y.output', 'cia402.1.velocity-fb')
+POSITION_PINS = ('pid.x.command', 'pid.x.feedback', 'pid.y.command', 'pid.y.feedback')
+
+# Following error colors (ANSI)
+GREEN = "\033[92m"
+YELLOW = "\033[93m"
+RED = "\033[91m"
+RESET = "\033[0m"
+
 class PIDTuner:
     def __init__(self):
         self.axis = 'x'
@@ -44,70 +66,50 @@ class PIDTuner:
             'FF2': 0.0001
         }
         
+        # Live values redraw period (s)
+        self.refresh_period = 0.5
+        # Gains rarely change behind the tuner's back: re-read them less often (s)
+        self.reread_period = 2.0
+        self.last_reread = 0.0
+        
+        # One halcmd process for the whole session
+        self.hal = HalCmd()
+        
     def halcmd(self, cmd):
         """Execute halcmd and return output"""
-        try:
-            result = subprocess.run(['halcmd', cmd], capture_output=True, text=True, timeout=1)
-            return result.stdout.strip()
-        except:
-            return ""
-    
-    def getp(self, pin):
-        """Get HAL pin/param value"""
-        try:
-            result = subprocess.run(['halcmd', 'getp', pin], capture_output=True, text=True, timeout=1)
-            return float(result.stdout.strip())
-        except:
-            return 0.0
+        return self.hal.run(cmd)
     
     def setp(self, pin, value):
         """Set HAL pin/param value"""
-        try:
-            subprocess.run(['halcmd', 'setp', pin, str(value)], capture_output=True, timeout=1)
-        except:
-            pass
+        self.hal.setp(pin, value)
     
     def read_current_values(self):
         """Read current PID values from HAL"""
-        for axis in ['x', 'y']:
-            self.params[axis]['P'] = self.getp(f'pid.{axis}.Pgain')
-            self.params[axis]['I'] = self.getp(f'pid.{axis}.Igain')
-            self.params[axis]['D'] = self.getp(f'pid.{axis}.Dgain')
-            self.params[axis]['FF1'] = self.getp(f'pid.{axis}.FF1')
-            self.params[axis]['FF2'] = self.getp(f'pid.{axis}.FF2')
+        # A pin that did not answer keeps its last known value: the P/p... keys
+        # step from it, a made-up 0.0 would be written to the drive
+        values = self.hal.getp_many(PARAM_PINS, default=None)
+        for (axis, param), value in zip(PARAM_KEYS, values):
+            if value is not None:
+                self.params[axis][param] = value
     
     def apply_value(self, param, value):
         """Apply a parameter value to current axis"""
-        pin_map = {
-            'P': 'Pgain',
-            'I': 'Igain', 
-            'D': 'Dgain',
-            'FF1': 'FF1',
-            'FF2': 'FF2'
-        }
-        self.setp(f'pid.{self.axis}.{pin_map[param]}', value)
+        self.setp(PINS[self.axis][param], value)
         self.params[self.axis][param] = value
     
     def get_errors(self):
         """Get current following errors"""
-        x_err = self.getp('pid.x.error') * 1000  # mm to µm
-        y_err = self.getp('pid.y.error') * 1000
-        return x_err, y_err
+        x_err, y_err = self.hal.getp_many(ERROR_PINS)
+        return x_err * 1000, y_err * 1000  # mm to µm
     
     def get_velocities(self):
         """Get current velocities"""
-        x_vel_cmd = self.getp('pid.x.output')
-        y_vel_cmd = self.getp('pid.y.output')
-        x_vel_fb = self.getp('cia402.0.velocity-fb')
-        y_vel_fb = self.getp('cia402.1.velocity-fb')
+        x_vel_cmd, x_vel_fb, y_vel_cmd, y_vel_fb = self.hal.getp_many(VELOCITY_PINS)
         return x_vel_cmd, x_vel_fb, y_vel_cmd, y_vel_fb
     
     def get_positions(self):
         """Get current positions"""
-        x_cmd = self.getp('pid.x.command')
-        x_fb = self.getp('pid.x.feedback')
-        y_cmd = self.getp('pid.y.command')
-        y_fb = self.getp('pid.y.feedback')
+        x_cmd, x_fb, y_cmd, y_fb = self.hal.getp_many(POSITION_PINS)
         return x_cmd, x_fb, y_cmd, y_fb
     
     def save_values(self):
@@ -118,11 +120,9 @@ class PIDTuner:
             f.write(f"# Date: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
             for axis in ['x', 'y']:
                 f.write(f"# Axis {axis.upper()}\n")
-                f.write(f"setp pid.{axis}.Pgain {self.params[axis]['P']}\n")
-                f.write(f"setp pid.{axis}.Igain {self.params[axis]['I']}\n")
-                f.write(f"setp pid.{axis}.Dgain {self.params[axis]['D']}\n")
-                f.write(f"setp pid.{axis}.FF1 {self.params[axis]['FF1']}\n")
-                f.write(f"setp pid.{axis}.FF2 {self.params[axis]['FF2']}\n\n")
+                for param, pin in PINS[axis].items():
+                    f.write(f"setp {pin} {self.params[axis][param]}\n")
+                f.write("\n")
         print(f"\n\033[92m✓ Saved to {filename}\033[0m")
     
     def zero_all(self):
@@ -140,43 +140,46 @@ class PIDTuner:
         x_vel_cmd, x_vel_fb, y_vel_cmd, y_vel_fb = self.get_velocities()
         x_cmd, x_fb, y_cmd, y_fb = self.get_positions()
         
+        # Whole frame built first, then written at once (no partial-frame flicker)
         # Clear screen and print header
-        print("\033[2J\033[H", end="")  # Clear screen
-        print("=" * 70)
-        print("  \033[1;36mPID TUNER - LinuxCNC CSV Mode\033[0m")
-        print("=" * 70)
+        out = ["\033[2J\033[H" + "=" * 70]
+        out.append("  \033[1;36mPID TUNER - LinuxCNC CSV Mode\033[0m")
+        out.append("=" * 70)
         
         # Current axis indicator
         axis_str = f"\033[1;33m[{self.axis.upper()}]\033[0m" 
-        print(f"\n  Active Axis: {axis_str}  (press X/Y to switch)")
+        out.append(f"\n  Active Axis: {axis_str}  (press X/Y to switch)")
         
         # PID Parameters
-        print("\n  \033[1mPID Parameters:\033[0m")
-        print("  " + "-" * 50)
-        print(f"  {'':10} {'X':>12} {'Y':>12}   {'Keys':>10}")
-        print(f"  {'Pgain':10} {self.params['x']['P']:12.1f} {self.params['y']['P']:12.1f}   {'P/p':>10}")
-        print(f"  {'Igain':10} {self.params['x']['I']:12.2f} {self.params['y']['I']:12.2f}   {'I/i':>10}")
-        print(f"  {'Dgain':10} {self.params['x']['D']:12.4f} {self.params['y']['D']:12.4f}   {'D/d':>10}")
-        print(f"  {'FF1':10} {self.params['x']['FF1']:12.3f} {self.params['y']['FF1']:12.3f}   {'F/f':>10}")
-        print(f"  {'FF2':10} {self.params['x']['FF2']:12.5f} {self.params['y']['FF2']:12.5f}   {'G/g':>10}")
+        out.append("\n  \033[1mPID Parameters:\033[0m")
+        out.append("  " + "-" * 50)
+        out.append(f"  {'':10} {'X':>12} {'Y':>12}   {'Keys':>10}")
+        out.append(f"  {'Pgain':10} {self.params['x']['P']:12.1f} {self.params['y']['P']:12.1f}   {'P/p':>10}")
+        out.append(f"  {'Igain':10} {self.params['x']['I']:12.2f} {self.params['y']['I']:12.2f}   {'I/i':>10}")
+        out.append(f"  {'Dgain':10} {self.params['x']['D']:12.4f} {self.params['y']['D']:12.4f}   {'D/d':>10}")
+        out.append(f"  {'FF1':10} {self.params['x']['FF1']:12.3f} {self.params['y']['FF1']:12.3f}   {'F/f':>10}")
+        out.append(f"  {'FF2':10} {self.params['x']['FF2']:12.5f} {self.params['y']['FF2']:12.5f}   {'G/g':>10}")
         
         # Live Monitoring
-        print("\n  \033[1mLive Monitoring:\033[0m")
-        print("  " + "-" * 50)
+        out.append("\n  \033[1mLive Monitoring:\033[0m")
+        out.append("  " + "-" * 50)
         
         # Following error with color coding
-        x_err_color = "\033[92m" if abs(x_err) < 20 else ("\033[93m" if abs(x_err) < 50 else "\033[91m")
-        y_err_color = "\033[92m" if abs(y_err) < 20 else ("\033[93m" if abs(y_err) < 50 else "\033[91m")
+        x_abs, y_abs = abs(x_err), abs(y_err)
+        x_err_color = GREEN if x_abs < 20 else (YELLOW if x_abs < 50 else RED)
+        y_err_color = GREEN if y_abs < 20 else (YELLOW if y_abs < 50 else RED)
         
-        print(f"  {'F-Error (µm)':15} {x_err_color}{x_err:>+10.1f}\033[0m {y_err_color}{y_err:>+10.1f}\033[0m")
-        print(f"  {'Position (mm)':15} {x_fb:>10.3f} {y_fb:>10.3f}")
-        print(f"  {'Vel Cmd (mm/s)':15} {x_vel_cmd:>10.2f} {y_vel_cmd:>10.2f}")
-        print(f"  {'Vel FB (mm/s)':15} {x_vel_fb:>10.2f} {y_vel_fb:>10.2f}")
+        out.append(f"  {'F-Error (µm)':15} {x_err_color}{x_err:>+10.1f}{RESET} {y_err_color}{y_err:>+10.1f}{RESET}")
+        out.append(f"  {'Position (mm)':15} {x_fb:>10.3f} {y_fb:>10.3f}")
+        out.append(f"  {'Vel Cmd (mm/s)':15} {x_vel_cmd:>10.2f} {y_vel_cmd:>10.2f}")
+        out.append(f"  {'Vel FB (mm/s)':15} {x_vel_fb:>10.2f} {y_vel_fb:>10.2f}")
         
         # Instructions
-        print("\n  " + "-" * 50)
-        print("  \033[90mS=Save  Z=Zero All  Q=Quit\033[0m")
-        print("  \033[90mUppercase=increase  Lowercase=decrease\033[0m")
+        out.append("\n  " + "-" * 50)
+        out.append("  \033[90mS=Save  R=Re-read  Z=Zero All  Q=Quit\033[0m")
+        out.append("  \033[90mUppercase=increase  Lowercase=decrease\033[0m")
+        sys.stdout.write("\n".join(out) + "\n")
+        sys.stdout.flush()
     
     def handle_key(self, key):
         """Handle keyboard input"""
@@ -206,6 +209,9 @@ class PIDTuner:
             self.axis = 'x'
         elif key in ['Y', 'y']:
             self.axis = 'y'
+        elif key in ['R', 'r']:
+            self.read_current_values()
+            self.last_reread = time.monotonic()
         elif key == 'Z':
             self.zero_all()
             time.sleep(1)
@@ -226,22 +232,28 @@ class PIDTuner:
             
             # Read initial values
             self.read_current_values()
+            self.last_reread = time.monotonic()
             
             while self.running:
                 self.print_status()
                 
-                # Non-blocking key read with timeout
-                if select.select([sys.stdin], [], [], 0.1)[0]:
+                # Block until a key arrives, or redraw live values on the refresh tick
+                if select.select([sys.stdin], [], [], self.refresh_period)[0]:
                     key = sys.stdin.read(1)
                     self.handle_key(key)
                 
-                # Re-read values to catch external changes
-                self.read_current_values()
+                # Gains written by handle_key are already known locally: re-read
+                # HAL only every reread_period (or on R), to catch external changes
+                now = time.monotonic()
+                if now - self.last_reread >= self.reread_period:
+                    self.read_current_values()
+                    self.last_reread = now
                 
         finally:
             # Restore terminal settings
             termios.tcsetattr(sys.stdin, termios.TCSADRAIN, self.saved_settings)
             print("\n\033[0m")  # Reset colors
+            self.hal.close()
 
 
 def main():
@@ -265,7 +277,11 @@ def main():
     print("\033[92m✓ Connected to LinuxCNC\033[0m")
     print("\nStarting tuner... Press any key to begin")
     
-    tuner = PIDTuner()
+    try:
+        tuner = PIDTuner()
+    except RuntimeError as e:
+        print(f"\033[91mError: {e}\033[0m")
+        sys.exit(1)
     tuner.run()
     
     print("Goodbye!")
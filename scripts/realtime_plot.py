@@ -10,26 +10,110 @@ import matplotlib
 matplotlib.use('TkAgg')  # Force TkAgg backend
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
-from collections import deque
 import time
 
+from hal_session import HalCmd
+
 # Configuration
 HISTORY_SIZE = 500  # Number of points to display
 UPDATE_INTERVAL = 50  # ms between updates
 
+TIME_WINDOW = HISTORY_SIZE * UPDATE_INTERVAL / 1000  # s shown on the time axis
+POS_MIN_SPAN = 1.0  # mm, smallest position range shown
+ERR_MIN_SPAN = 50.0  # µm, smallest error range shown
+ERR_GUIDE = 20.0  # µm, ± guide lines on the error plots
+# Both guides as one NaN-split line, x in axes fraction: it spans the view
+# whatever the time limits and stays out of the data limits
+ERR_GUIDE_XY = ([0, 1, np.nan, 0, 1],
+                [ERR_GUIDE, ERR_GUIDE, np.nan, -ERR_GUIDE, -ERR_GUIDE])
+XY_LIMITS_EVERY = 20  # frames between XY trajectory limit checks
+STATS_EVERY = 10  # frames between stats box refreshes
+
+# Pins read every frame, in update() unpacking order
+HAL_PINS = ('pid.x.command', 'pid.x.feedback', 'pid.x.error',
+            'pid.y.command', 'pid.y.feedback', 'pid.y.error')
+# PID settings, only read when the stats box is refreshed
+STATS_PINS = ('pid.x.Pgain', 'pid.x.Igain', 'pid.x.FF1', 'pid.x.FF2')
+
+# Stats box, filled with % every STATS_EVERY frames
+STATS_TEMPLATE = """╔══════════════════════════════════╗
+║     LIVE STATISTICS              ║
+╠══════════════════════════════════╣
+║  X Error:                        ║
+║    Current: %+8.1f µm          ║
+║    Min:     %+8.1f µm          ║
+║    Max:     %+8.1f µm          ║
+║    RMS:     %8.1f µm          ║
+╠══════════════════════════════════╣
+║  Y Error:                        ║
+║    Current: %+8.1f µm          ║
+║    Min:     %+8.1f µm          ║
+║    Max:     %+8.1f µm          ║
+║    RMS:     %8.1f µm          ║
+╠══════════════════════════════════╣
+║  PID Settings (X=Y):             ║
+║    P=%6.1f  I=%6.1f           ║
+║    FF1=%5.2f  FF2=%7.5f        ║
+╚══════════════════════════════════╝"""
+
+def limits_stale(current, lo, hi, min_span):
+    """True once data in [lo, hi] leaves the current limits or shrinks well inside them"""
+    cur_min, cur_max = current
+    span = cur_max - cur_min
+    if lo < cur_min or hi > cur_max:
+        return True
+    return hi - lo < 0.25 * span and span > 1.25 * min_span
+
+
+def padded_limits(lo, hi, min_span):
+    """Limits centered on [lo, hi] with a 20% margin, at least min_span wide"""
+    center = 0.5 * (lo + hi)
+    half = 0.6 * max(hi - lo, min_span)
+    return center - half, center + half
+
+
+class RingBuffer:
+    """Fixed-size float history, oldest sample first"""
+    def __init__(self, size):
+        self.size = size
+        # Every sample is written twice, so the last `size` samples are always
+        # one contiguous slice: view() never copies or reorders
+        self.data = np.zeros(2 * size)
+        self.idx = 0
+        self.n = 0
+    
+    def push(self, value):
+        self.data[self.idx] = value
+        self.data[self.idx + self.size] = value
+        self.idx = (self.idx + 1) % self.size
+        if self.n < self.size:
+            self.n += 1
+    
+    def view(self):
+        if self.n < self.size:
+            return self.data[:self.n]
+        return self.data[self.idx:self.idx + self.size]
+    
+    def __len__(self):
+        return self.n
+
+
 class RealtimePlotter:
     def __init__(self):
         # Data buffers
-        self.time_data = deque(maxlen=HISTORY_SIZE)
-        self.x_cmd = deque(maxlen=HISTORY_SIZE)
-        self.x_fb = deque(maxlen=HISTORY_SIZE)
-        self.x_err = deque(maxlen=HISTORY_SIZE)
-        self.y_cmd = deque(maxlen=HISTORY_SIZE)
-        self.y_fb = deque(maxlen=HISTORY_SIZE)
-        self.y_err = deque(maxlen=HISTORY_SIZE)
+        self.time_data = RingBuffer(HISTORY_SIZE)
+        self.x_cmd = RingBuffer(HISTORY_SIZE)
+        self.x_fb = RingBuffer(HISTORY_SIZE)
+        self.x_err = RingBuffer(HISTORY_SIZE)
+        self.y_cmd = RingBuffer(HISTORY_SIZE)
+        self.y_fb = RingBuffer(HISTORY_SIZE)
+        self.y_err = RingBuffer(HISTORY_SIZE)
         
         self.start_time = time.time()
         
+        # One halcmd process for all reads
+        self.hal = HalCmd(timeout=0.1)
+        
         # Create figure with subplots
         self.fig, self.axes = plt.subplots(3, 2, figsize=(14, 9))
         self.fig.suptitle('LinuxCNC Real-Time Position Monitor (CSV Mode)', fontsize=14, fontweight='bold')
@@ -58,8 +142,9 @@ class RealtimePlotter:
         self.ax_x_err.set_ylabel('Error (µm)')
         self.line_x_err, = self.ax_x_err.plot([], [], 'g-', linewidth=1)
         self.ax_x_err.axhline(y=0, color='k', linestyle='-', linewidth=0.5)
-        self.ax_x_err.axhline(y=20, color='r', linestyle='--', linewidth=0.5, alpha=0.5)
-        self.ax_x_err.axhline(y=-20, color='r', linestyle='--', linewidth=0.5, alpha=0.5)
+        self.ax_x_err.plot(*ERR_GUIDE_XY, 'r--', linewidth=0.5, alpha=0.5,
+                            transform=self.ax_x_err.get_yaxis_transform(),
+                            scalex=False, scaley=False)
         self.ax_x_err.grid(True, alpha=0.3)
         
         # Y Error plot
@@ -68,8 +153,9 @@ class RealtimePlotter:
         self.ax_y_err.set_ylabel('Error (µm)')
         self.line_y_err, = self.ax_y_err.plot([], [], 'g-', linewidth=1)
         self.ax_y_err.axhline(y=0, color='k', linestyle='-', linewidth=0.5)
-        self.ax_y_err.axhline(y=20, color='r', linestyle='--', linewidth=0.5, alpha=0.5)
-        self.ax_y_err.axhline(y=-20, color='r', linestyle='--', linewidth=0.5, alpha=0.5)
+        self.ax_y_err.plot(*ERR_GUIDE_XY, 'r--', linewidth=0.5, alpha=0.5,
+                            transform=self.ax_y_err.get_yaxis_transform(),
+                            scalex=False, scaley=False)
         self.ax_y_err.grid(True, alpha=0.3)
         
         # XY Plot (trajectory)
@@ -81,7 +167,7 @@ class RealtimePlotter:
         self.line_xy_fb, = self.ax_xy.plot([], [], 'r-', label='Feedback', linewidth=1, alpha=0.7)
         self.ax_xy.legend(loc='upper right')
         self.ax_xy.grid(True, alpha=0.3)
-        self.ax_xy.set_aspect('equal', adjustable='datalim')
+        self.ax_xy.set_aspect('equal', adjustable='box')
         
         # Stats display
         self.ax_stats = self.axes[2, 1]
@@ -89,100 +175,90 @@ class RealtimePlotter:
         self.stats_text = self.ax_stats.text(0.1, 0.9, '', transform=self.ax_stats.transAxes,
                                               fontsize=11, verticalalignment='top', fontfamily='monospace')
         
+        # The four time plots share one time axis: a single set_xlim moves them all
+        for ax in (self.ax_y_pos, self.ax_x_err, self.ax_y_err):
+            ax.sharex(self.ax_x_pos)
+        self.ax_x_pos.set_xlim(0, TIME_WINDOW)
+        
         plt.tight_layout()
         
-    def get_hal_value(self, pin):
-        """Get HAL pin value"""
-        try:
-            result = subprocess.run(['halcmd', 'getp', pin], 
-                                  capture_output=True, text=True, timeout=0.1)
-            return float(result.stdout.strip())
-        except:
-            return 0.0
-    
     def update(self, frame):
         """Update function called by animation"""
         current_time = time.time() - self.start_time
         
-        # Read HAL values
-        x_cmd = self.get_hal_value('pid.x.command')
-        x_fb = self.get_hal_value('pid.x.feedback')
-        x_err = self.get_hal_value('pid.x.error') * 1000  # mm to µm
-        
-        y_cmd = self.get_hal_value('pid.y.command')
-        y_fb = self.get_hal_value('pid.y.feedback')
-        y_err = self.get_hal_value('pid.y.error') * 1000
+        # Read HAL values (positions and errors in one round-trip)
+        x_cmd, x_fb, x_err, y_cmd, y_fb, y_err = self.hal.getp_many(HAL_PINS)
+        x_err *= 1000  # mm to µm
+        y_err *= 1000
         
         # Append data
-        self.time_data.append(current_time)
-        self.x_cmd.append(x_cmd)
-        self.x_fb.append(x_fb)
-        self.x_err.append(x_err)
-        self.y_cmd.append(y_cmd)
-        self.y_fb.append(y_fb)
-        self.y_err.append(y_err)
-        
-        # Convert to arrays
-        t = np.array(self.time_data)
-        
-        # Update X position plot
-        self.line_x_cmd.set_data(t, np.array(self.x_cmd))
-        self.line_x_fb.set_data(t, np.array(self.x_fb))
-        self.ax_x_pos.relim()
-        self.ax_x_pos.autoscale_view()
-        
-        # Update Y position plot
-        self.line_y_cmd.set_data(t, np.array(self.y_cmd))
-        self.line_y_fb.set_data(t, np.array(self.y_fb))
-        self.ax_y_pos.relim()
-        self.ax_y_pos.autoscale_view()
-        
-        # Update X error plot
-        self.line_x_err.set_data(t, np.array(self.x_err))
-        self.ax_x_err.relim()
-        self.ax_x_err.autoscale_view()
-        
-        # Update Y error plot  
-        self.line_y_err.set_data(t, np.array(self.y_err))
-        self.ax_y_err.relim()
-        self.ax_y_err.autoscale_view()
-        
-        # Update XY plot
-        self.line_xy_cmd.set_data(np.array(self.x_cmd), np.array(self.y_cmd))
-        self.line_xy_fb.set_data(np.array(self.x_fb), np.array(self.y_fb))
-        self.ax_xy.relim()
-        self.ax_xy.autoscale_view()
-        
-        # Update stats
-        if len(self.x_err) > 10:
-            x_err_arr = np.array(self.x_err)
-            y_err_arr = np.array(self.y_err)
-            
-            # Get PID values
-            p_gain = self.get_hal_value('pid.x.Pgain')
-            i_gain = self.get_hal_value('pid.x.Igain')
-            ff1 = self.get_hal_value('pid.x.FF1')
-            ff2 = self.get_hal_value('pid.x.FF2')
+        self.time_data.push(current_time)
+        self.x_cmd.push(x_cmd)
+        self.x_fb.push(x_fb)
+        self.x_err.push(x_err)
+        self.y_cmd.push(y_cmd)
+        self.y_fb.push(y_fb)
+        self.y_err.push(y_err)
+        
+        # Views on the history buffers, no copy
+        t = self.time_data.view()
+        xc, xf, xe = self.x_cmd.view(), self.x_fb.view(), self.x_err.view()
+        yc, yf, ye = self.y_cmd.view(), self.y_fb.view(), self.y_err.view()
+        
+        self.line_x_cmd.set_data(t, xc)
+        self.line_x_fb.set_data(t, xf)
+        self.line_y_cmd.set_data(t, yc)
+        self.line_y_fb.set_data(t, yf)
+        self.line_x_err.set_data(t, xe)
+        self.line_y_err.set_data(t, ye)
+        self.line_xy_cmd.set_data(xc, yc)
+        self.line_xy_fb.set_data(xf, yf)
+        
+        # Blitting only redraws the lines: limits stay fixed, and any change
+        # of them needs one full redraw for the ticks
+        redraw = False
+        if current_time > self.ax_x_pos.get_xlim()[1]:
+            # Scroll the time axis a quarter window at a time
+            t_min = current_time - 0.75 * TIME_WINDOW
+            self.ax_x_pos.set_xlim(t_min, t_min + TIME_WINDOW)
+            redraw = True
+        
+        limits = (
+            (self.ax_x_pos, min(xc.min(), xf.min()), max(xc.max(), xf.max()), POS_MIN_SPAN),
+            (self.ax_y_pos, min(yc.min(), yf.min()), max(yc.max(), yf.max()), POS_MIN_SPAN),
+            # Keep the ±ERR_GUIDE lines in view
+            (self.ax_x_err, min(xe.min(), -ERR_GUIDE), max(xe.max(), ERR_GUIDE), ERR_MIN_SPAN),
+            (self.ax_y_err, min(ye.min(), -ERR_GUIDE), max(ye.max(), ERR_GUIDE), ERR_MIN_SPAN),
+        )
+        for ax, lo, hi, min_span in limits:
+            if limits_stale(ax.get_ylim(), lo, hi, min_span):
+                ax.set_ylim(padded_limits(lo, hi, min_span))
+                redraw = True
+        
+        if frame % XY_LIMITS_EVERY == 0:
+            x_lo, x_hi = min(xc.min(), xf.min()), max(xc.max(), xf.max())
+            y_lo, y_hi = min(yc.min(), yf.min()), max(yc.max(), yf.max())
+            # Same span on both axes keeps the trajectory box square
+            side = max(x_hi - x_lo, y_hi - y_lo, POS_MIN_SPAN)
+            if (limits_stale(self.ax_xy.get_xlim(), x_lo, x_hi, side) or
+                    limits_stale(self.ax_xy.get_ylim(), y_lo, y_hi, side)):
+                self.ax_xy.set_xlim(padded_limits(x_lo, x_hi, side))
+                self.ax_xy.set_ylim(padded_limits(y_lo, y_hi, side))
+                redraw = True
+        
+        if redraw:
+            self.fig.canvas.draw()
+        
+        # Update stats (min/max/RMS barely move between frames)
+        if len(self.x_err) > 10 and frame % STATS_EVERY == 0:
+            p_gain, i_gain, ff1, ff2 = self.hal.getp_many(STATS_PINS)
             
-            stats = f"""╔══════════════════════════════════╗
-║     LIVE STATISTICS              ║
-╠══════════════════════════════════╣
-║  X Error:                        ║
-║    Current: {x_err:+8.1f} µm          ║
-║    Min:     {x_err_arr.min():+8.1f} µm          ║
-║    Max:     {x_err_arr.max():+8.1f} µm          ║
-║    RMS:     {np.sqrt(np.mean(x_err_arr**2)):8.1f} µm          ║
-╠══════════════════════════════════╣
-║  Y Error:                        ║
-║    Current: {y_err:+8.1f} µm          ║
-║    Min:     {y_err_arr.min():+8.1f} µm          ║
-║    Max:     {y_err_arr.max():+8.1f} µm          ║
-║    RMS:     {np.sqrt(np.mean(y_err_arr**2)):8.1f} µm          ║
-╠══════════════════════════════════╣
-║  PID Settings (X=Y):             ║
-║    P={p_gain:6.1f}  I={i_gain:6.1f}           ║
-║    FF1={ff1:5.2f}  FF2={ff2:7.5f}        ║
-╚══════════════════════════════════╝"""
+            # Same views as the plotted lines; dot() gives the RMS without
+            # squaring into a temporary array
+            stats = STATS_TEMPLATE % (
+                x_err, xe.min(), xe.max(), np.sqrt(np.dot(xe, xe) / xe.size),
+                y_err, ye.min(), ye.max(), np.sqrt(np.dot(ye, ye) / ye.size),
+                p_gain, i_gain, ff1, ff2)
             self.stats_text.set_text(stats)
         
         return (self.line_x_cmd, self.line_x_fb, self.line_y_cmd, self.line_y_fb,
@@ -192,7 +268,7 @@ class RealtimePlotter:
     def run(self):
         """Start the animation"""
         self.anim = FuncAnimation(self.fig, self.update, interval=UPDATE_INTERVAL, 
-                                  blit=False, cache_frame_data=False)
+                                  blit=True, cache_frame_data=False)
         plt.show()
 
 
@@ -214,15 +290,15 @@ def main():
     print("Connected! Creating plot...")
     
     # Create plotter 
-    plotter = RealtimePlotter()
-    
-    # Keep animation reference as global to prevent garbage collection
-    global anim
-    anim = FuncAnimation(plotter.fig, plotter.update, interval=UPDATE_INTERVAL, 
-                        blit=False, cache_frame_data=False, save_count=100)
+    try:
+        plotter = RealtimePlotter()
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        return
     
+    # run() keeps the single animation on plotter.anim, safe from garbage collection
     print("Showing window...")
-    plt.show(block=True)
+    plotter.run()
     print("Done.")
 
 
@@ -27,6 +27,10 @@ HZ_TO_RPM  = 15.0    # 1 Hz = 15 RPM  (moteur 8 pôles, 4 paires — 400 Hz = 60
 STEPS    = END_HZ - START_HZ + 1        # 200 steps
 DWELL    = RAMP_SEC / STEPS             # 0.1 s par step
 
+# Barres de progression précalculées : une par nombre de cases pleines
+BAR_W    = 30
+BARS     = ["█" * i + "░" * (BAR_W - i) for i in range(BAR_W + 1)]
+
 
 def check_machine_state(stat):
     stat.poll()
@@ -54,18 +58,24 @@ def main():
         c.wait_complete()
 
     try:
+        # Échéances absolues (monotonic) : la latence de c.spindle() et de
+        # l'affichage ne s'accumule pas sur la durée de la rampe
+        next_tick = time.monotonic()
         for hz in range(START_HZ, END_HZ + 1):
             rpm = hz * HZ_TO_RPM
             c.spindle(linuxcnc.SPINDLE_FORWARD, rpm)
 
             # Barre de progression
             pct    = (hz - START_HZ) / (END_HZ - START_HZ) * 100
-            bar_w  = 30
-            filled = int(bar_w * pct / 100)
-            bar    = "█" * filled + "░" * (bar_w - filled)
+            bar    = BARS[int(BAR_W * pct / 100)]
             print(f"\r[{bar}] {hz:3d} Hz  {rpm:6.0f} RPM  {pct:5.1f}%", end="", flush=True)
 
-            time.sleep(DWELL)
+            next_tick += DWELL
+            sleep_for = next_tick - time.monotonic()
+            if sleep_for > 0:
+                time.sleep(sleep_for)
+            else:
+                next_tick = time.monotonic()
 
         print("\n\nVitesse maximale atteinte — maintien 3 s...")
         time.sleep(3)